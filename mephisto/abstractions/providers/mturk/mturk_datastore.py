@@ -9,6 +9,7 @@ import sqlite3
 import os
 import threading
 import time
+import weakref
 
 from datetime import datetime
 from collections import defaultdict
@@ -16,9 +17,9 @@ from collections import defaultdict
 
 from botocore.exceptions import ClientError  # type: ignore
 from botocore.exceptions import ProfileNotFound  # type: ignore
-from mephisto.abstractions.databases.local_database import is_unique_failure
+from mephisto.abstractions.providers.mturk.mturk_utils import botoconfig
 
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterable, Optional, Tuple
 
 from mephisto.utils.logger_core import get_logger
 
@@ -27,7 +28,7 @@ logger = get_logger(name=__name__)
 MTURK_REGION_NAME = "us-east-1"
 
 CREATE_HITS_TABLE = """CREATE TABLE IF NOT EXISTS hits (
-    hit_id TEXT PRIMARY KEY UNIQUE,
+    hit_id TEXT PRIMARY KEY,
     unit_id TEXT,
     assignment_id TEXT,
     link TEXT,
@@ -43,7 +44,7 @@ CREATE_RUN_MAP_TABLE = """CREATE TABLE IF NOT EXISTS run_mappings (
 """
 
 CREATE_RUNS_TABLE = """CREATE TABLE IF NOT EXISTS runs (
-    run_id TEXT PRIMARY KEY UNIQUE,
+    run_id TEXT PRIMARY KEY,
     arn_id TEXT,
     hit_type_id TEXT NOT NULL,
     hit_config_path TEXT NOT NULL,
@@ -57,7 +58,7 @@ UPDATE_RUNS_TABLE_1 = """ALTER TABLE runs
 """
 
 CREATE_QUALIFICATIONS_TABLE = """CREATE TABLE IF NOT EXISTS qualifications (
-    qualification_name TEXT PRIMARY KEY UNIQUE,
+    qualification_name TEXT PRIMARY KEY,
     requester_id TEXT,
     mturk_qualification_name TEXT,
     mturk_qualification_id TEXT,
@@ -77,7 +78,7 @@ class MTurkDatastore:
     def __init__(self, datastore_root: str):
         """Initialize the session storage to empty, initialize tables if needed"""
         self.session_storage: Dict[str, boto3.Session] = {}
-        self.table_access_condition = threading.Condition()
+        self.client_storage: Dict[str, Any] = {}
         self.conn: Dict[int, sqlite3.Connection] = {}
         self.db_path = os.path.join(datastore_root, "mturk.db")
         self.init_tables()
@@ -92,11 +93,37 @@ class MTurkDatastore:
         """
         curr_thread = threading.get_ident()
         if curr_thread not in self.conn or self.conn[curr_thread] is None:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn = sqlite3.connect(
+                self.db_path, check_same_thread=False, cached_statements=128
+            )
             conn.row_factory = sqlite3.Row
+            # WAL with relaxed syncing avoids a full fsync per commit while
+            # remaining consistent if the application crashes
+            conn.execute("PRAGMA journal_mode = WAL;")
+            conn.execute("PRAGMA synchronous = NORMAL;")
+            conn.execute("PRAGMA temp_store = MEMORY;")
+            # Memory-map the database (256MB) with a larger page cache
+            # (64MB) so the frequent point-lookups read hot pages without
+            # syscalls or extra buffer copies
+            conn.execute("PRAGMA mmap_size = 268435456;")
+            conn.execute("PRAGMA cache_size = -65536;")
             self.conn[curr_thread] = conn
+            # Close and drop this connection once its owning thread is
+            # collected, so dead threads don't leak sqlite handles
+            weakref.finalize(
+                threading.current_thread(),
+                self._release_connection,
+                curr_thread,
+                conn,
+            )
         return self.conn[curr_thread]
 
+    def _release_connection(self, thread_id: int, conn: sqlite3.Connection) -> None:
+        """Close a thread's connection, removing it from the shared map"""
+        if self.conn.get(thread_id) is conn:
+            del self.conn[thread_id]
+        conn.close()
+
     def _mark_hit_mapping_update(self, unit_id: str) -> None:
         """
         Update the last hit mapping time to mark a change to the hit
@@ -108,21 +135,20 @@ class MTurkDatastore:
         """
         Run all the table creation SQL queries to ensure the expected tables exist
         """
-        with self.table_access_condition:
-            conn = self._get_connection()
-            conn.execute("PRAGMA foreign_keys = 1")
-            with conn:
+        conn = self._get_connection()
+        conn.execute("PRAGMA foreign_keys = 1")
+        with conn:
+            c = conn.cursor()
+            c.execute(CREATE_HITS_TABLE)
+            c.execute(CREATE_RUNS_TABLE)
+            c.execute(CREATE_RUN_MAP_TABLE)
+            c.execute(CREATE_QUALIFICATIONS_TABLE)
+        with conn:
+            try:
                 c = conn.cursor()
-                c.execute(CREATE_HITS_TABLE)
-                c.execute(CREATE_RUNS_TABLE)
-                c.execute(CREATE_RUN_MAP_TABLE)
-                c.execute(CREATE_QUALIFICATIONS_TABLE)
-            with conn:
-                try:
-                    c = conn.cursor()
-                    c.execute(UPDATE_RUNS_TABLE_1)
-                except Exception as _e:
-                    pass  # extra column already exists
+                c.execute(UPDATE_RUNS_TABLE_1)
+            except Exception as _e:
+                pass  # extra column already exists
 
     def is_hit_mapping_in_sync(self, unit_id: str, compare_time: float):
         """
@@ -132,48 +158,55 @@ class MTurkDatastore:
 
     def new_hit(self, hit_id: str, hit_link: str, duration: int, run_id: str) -> None:
         """Register a new HIT mapping in the table"""
-        with self.table_access_condition, self._get_connection() as conn:
-            c = conn.cursor()
-            c.execute(
+        self.new_hits([(hit_id, hit_link, duration, run_id)])
+
+    def new_hits(self, hit_rows: Iterable[Tuple[str, str, int, str]]) -> None:
+        """
+        Register a batch of new HIT mappings, given as tuples of
+        (hit_id, hit_link, duration, run_id), in a single transaction
+        so the batch pays for one commit rather than one per HIT
+        """
+        hit_rows = list(hit_rows)
+        with self._get_connection() as conn:
+            conn.executemany(
                 """INSERT INTO hits(
                     hit_id,
                     link,
                     assignment_time_in_seconds
                 ) VALUES (?, ?, ?);""",
-                (hit_id, hit_link, duration),
+                [(hit_id, link, duration) for (hit_id, link, duration, _) in hit_rows],
             )
-            c.execute(
+            conn.executemany(
                 """INSERT INTO run_mappings(
                     hit_id,
                     run_id
                 ) VALUES (?, ?);""",
-                (hit_id, run_id),
+                [(hit_id, run_id) for (hit_id, _, _, run_id) in hit_rows],
             )
 
     def get_unassigned_hit_ids(self, run_id: str):
         """
         Return a list of all HIT ids that haven't been assigned
         """
-        with self.table_access_condition:
-            conn = self._get_connection()
-            c = conn.cursor()
-            c.execute(
-                """
-                SELECT
-                    hit_id,
-                    unit_id,
-                    run_id
-                FROM
-                    hits
-                INNER JOIN run_mappings
-                    USING  (hit_id)
-                WHERE unit_id IS NULL
-                AND run_id = ?;
-                """,
-                (run_id,),
-            )
-            results = c.fetchall()
-            return [r["hit_id"] for r in results]
+        conn = self._get_connection()
+        c = conn.cursor()
+        c.execute(
+            """
+            SELECT
+                hit_id,
+                unit_id,
+                run_id
+            FROM
+                hits
+            INNER JOIN run_mappings
+                USING  (hit_id)
+            WHERE unit_id IS NULL
+            AND run_id = ?;
+            """,
+            (run_id,),
+        )
+        results = c.fetchall()
+        return [r["hit_id"] for r in results]
 
     def register_assignment_to_hit(
         self,
@@ -188,18 +221,18 @@ class MTurkDatastore:
         logger.debug(
             f"Attempting to assign HIT {hit_id}, Unit {unit_id}, Assignment {assignment_id}."
         )
-        with self.table_access_condition, self._get_connection() as conn:
+        with self._get_connection() as conn:
             c = conn.cursor()
             c.execute(
                 """
-                SELECT * from hits
+                SELECT unit_id from hits
                 WHERE hit_id = ?
                 """,
                 (hit_id,),
             )
-            results = c.fetchall()
-            if len(results) > 0 and results[0]["unit_id"] is not None:
-                old_unit_id = results[0]["unit_id"]
+            row = c.fetchone()
+            if row is not None and row["unit_id"] is not None:
+                old_unit_id = row["unit_id"]
                 self._mark_hit_mapping_update(old_unit_id)
                 logger.debug(
                     f"Cleared HIT mapping cache for previous unit, {old_unit_id}"
@@ -220,48 +253,42 @@ class MTurkDatastore:
         Clear the hit mapping that maps the given unit,
         if such a unit-hit map exists
         """
-        with self.table_access_condition, self._get_connection() as conn:
+        with self._get_connection() as conn:
             c = conn.cursor()
             c.execute(
-                """
-                SELECT * from hits
+                """UPDATE hits
+                SET assignment_id = NULL, unit_id = NULL
                 WHERE unit_id = ?
                 """,
                 (unit_id,),
             )
-            results = c.fetchall()
-            if len(results) == 0:
+            if c.rowcount == 0:
                 return
-            if len(results) > 1:
+            if c.rowcount > 1:
                 print(
                     "WARNING - UNIT HAD MORE THAN ONE HIT MAPPED TO IT!",
                     unit_id,
-                    [dict(r) for r in results],
+                    f"{c.rowcount} mappings cleared",
                 )
-            result_hit_id = results[0]["hit_id"]
-            c.execute(
-                """UPDATE hits
-                SET assignment_id = ?, unit_id = ?
-                WHERE hit_id = ?
-                """,
-                (None, None, result_hit_id),
-            )
             self._mark_hit_mapping_update(unit_id)
 
     def get_hit_mapping(self, unit_id: str) -> sqlite3.Row:
         """Get the mapping between Mephisto IDs and MTurk ids"""
-        with self.table_access_condition:
-            conn = self._get_connection()
-            c = conn.cursor()
-            c.execute(
-                """
-                SELECT * from hits
-                WHERE unit_id = ?
-                """,
-                (unit_id,),
-            )
-            results = c.fetchall()
-            return results[0]
+        conn = self._get_connection()
+        c = conn.cursor()
+        c.execute(
+            """
+            SELECT * from hits
+            WHERE unit_id = ?
+            """,
+            (unit_id,),
+        )
+        result = c.fetchone()
+        if result is None:
+            # Keep the IndexError contract that callers of the previous
+            # fetchall()[0] implementation rely on
+            raise IndexError(f"No hit mapping found for unit {unit_id}")
+        return result
 
     def register_run(
         self,
@@ -271,7 +298,7 @@ class MTurkDatastore:
         frame_height: int = 0,
     ) -> None:
         """Register a new task run in the mturk table"""
-        with self.table_access_condition, self._get_connection() as conn:
+        with self._get_connection() as conn:
             c = conn.cursor()
             c.execute(
                 """INSERT INTO runs(
@@ -286,18 +313,19 @@ class MTurkDatastore:
 
     def get_run(self, run_id: str) -> sqlite3.Row:
         """Get the details for a run by task_run_id"""
-        with self.table_access_condition:
-            conn = self._get_connection()
-            c = conn.cursor()
-            c.execute(
-                """
-                SELECT * from runs
-                WHERE run_id = ?
-                """,
-                (run_id,),
-            )
-            results = c.fetchall()
-            return results[0]
+        conn = self._get_connection()
+        c = conn.cursor()
+        c.execute(
+            """
+            SELECT * from runs
+            WHERE run_id = ?
+            """,
+            (run_id,),
+        )
+        result = c.fetchone()
+        if result is None:
+            raise IndexError(f"No run found for id {run_id}")
+        return result
 
     def create_qualification_mapping(
         self,
@@ -312,59 +340,27 @@ class MTurkDatastore:
 
         Repeat entries with the same `qualification_name` will be idempotent
         """
-        try:
-            with self.table_access_condition, self._get_connection() as conn:
-                c = conn.cursor()
-                c.execute(
-                    """INSERT INTO qualifications(
-                        qualification_name,
-                        requester_id,
-                        mturk_qualification_name,
-                        mturk_qualification_id
-                    ) VALUES (?, ?, ?, ?);""",
-                    (
-                        qualification_name,
-                        requester_id,
-                        mturk_qualification_name,
-                        mturk_qualification_id,
-                    ),
-                )
-                return None
-        except sqlite3.IntegrityError as e:
-            if is_unique_failure(e):
-                # Ignore attempt to add another mapping for an existing key
-                qual = self.get_qualification_mapping(qualification_name)
-                logger.debug(
-                    f"Multiple mturk mapping creations for qualification {qualification_name}. "
-                    f"Found existing one: {qual}. "
-                )
-                assert (
-                    qual is not None
-                ), "Cannot be none given is_unique_failure on insert"
-                cur_requester_id = qual["requester_id"]
-                cur_mturk_qualification_name = qual["mturk_qualification_name"]
-                cur_mturk_qualification_id = qual["mturk_qualification_id"]
-                if cur_requester_id != requester_id:
-                    logger.warning(
-                        f"MTurk Qualification mapping create for {qualification_name} under requester "
-                        f"{requester_id}, already exists under {cur_requester_id}."
-                    )
-                if cur_mturk_qualification_name != mturk_qualification_name:
-                    logger.warning(
-                        f"MTurk Qualification mapping create for {qualification_name} with mturk name "
-                        f"{mturk_qualification_name}, already exists under {cur_mturk_qualification_name}."
-                    )
-                return None
-            else:
-                raise e
-
-    def get_qualification_mapping(
-        self, qualification_name: str
-    ) -> Optional[sqlite3.Row]:
-        """Get the mapping between Mephisto qualifications and MTurk qualifications"""
-        with self.table_access_condition:
-            conn = self._get_connection()
+        with self._get_connection() as conn:
             c = conn.cursor()
+            c.execute(
+                """INSERT INTO qualifications(
+                    qualification_name,
+                    requester_id,
+                    mturk_qualification_name,
+                    mturk_qualification_id
+                ) VALUES (?, ?, ?, ?)
+                ON CONFLICT(qualification_name) DO NOTHING;""",
+                (
+                    qualification_name,
+                    requester_id,
+                    mturk_qualification_name,
+                    mturk_qualification_id,
+                ),
+            )
+            if c.rowcount > 0:
+                return None
+            # A mapping already existed - compare against it within the
+            # same transaction, rather than erroring and re-querying
             c.execute(
                 """
                 SELECT * from qualifications
@@ -372,10 +368,41 @@ class MTurkDatastore:
                 """,
                 (qualification_name,),
             )
-            results = c.fetchall()
-            if len(results) == 0:
-                return None
-            return results[0]
+            qual = c.fetchone()
+            logger.debug(
+                f"Multiple mturk mapping creations for qualification {qualification_name}. "
+                f"Found existing one: {qual}. "
+            )
+            assert qual is not None, "Cannot be none given the insert conflicted"
+            cur_requester_id = qual["requester_id"]
+            cur_mturk_qualification_name = qual["mturk_qualification_name"]
+            cur_mturk_qualification_id = qual["mturk_qualification_id"]
+            if cur_requester_id != requester_id:
+                logger.warning(
+                    f"MTurk Qualification mapping create for {qualification_name} under requester "
+                    f"{requester_id}, already exists under {cur_requester_id}."
+                )
+            if cur_mturk_qualification_name != mturk_qualification_name:
+                logger.warning(
+                    f"MTurk Qualification mapping create for {qualification_name} with mturk name "
+                    f"{mturk_qualification_name}, already exists under {cur_mturk_qualification_name}."
+                )
+            return None
+
+    def get_qualification_mapping(
+        self, qualification_name: str
+    ) -> Optional[sqlite3.Row]:
+        """Get the mapping between Mephisto qualifications and MTurk qualifications"""
+        conn = self._get_connection()
+        c = conn.cursor()
+        c.execute(
+            """
+            SELECT * from qualifications
+            WHERE qualification_name = ?
+            """,
+            (qualification_name,),
+        )
+        return c.fetchone()
 
     def get_session_for_requester(self, requester_name: str) -> boto3.Session:
         """
@@ -395,15 +422,25 @@ class MTurkDatastore:
         Return the client for the given requester, which should allow
         direct calls to the mturk surface
         """
-        return self.get_session_for_requester(requester_name).client("mturk")
+        if requester_name not in self.client_storage:
+            self.client_storage[requester_name] = self.get_session_for_requester(
+                requester_name
+            ).client("mturk", config=botoconfig)
+        return self.client_storage[requester_name]
 
     def get_sandbox_client_for_requester(self, requester_name: str) -> Any:
         """
         Return the client for the given requester, which should allow
         direct calls to the mturk surface
         """
-        return self.get_session_for_requester(requester_name).client(
-            service_name="mturk",
-            region_name="us-east-1",
-            endpoint_url="https://mturk-requester-sandbox.us-east-1.amazonaws.com",
-        )
+        client_key = f"sandbox_{requester_name}"
+        if client_key not in self.client_storage:
+            self.client_storage[client_key] = self.get_session_for_requester(
+                requester_name
+            ).client(
+                service_name="mturk",
+                region_name="us-east-1",
+                endpoint_url="https://mturk-requester-sandbox.us-east-1.amazonaws.com",
+                config=botoconfig,
+            )
+        return self.client_storage[client_key]
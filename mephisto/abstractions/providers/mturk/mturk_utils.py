@@ -4,11 +4,14 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import asyncio
 import boto3  # type: ignore
 import os
 import json
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from tqdm import tqdm  # type: ignore
 from typing import Dict, Optional, Tuple, List, Any, TYPE_CHECKING
 from datetime import datetime
@@ -31,17 +34,79 @@ CLEANUP_CHECK_TIME = 24 * 60 * 60  # Check every day!
 MTURK_TASK_FEE = 0.2
 MTURK_BONUS_FEE = 0.2
 SANDBOX_ENDPOINT = "https://mturk-requester-sandbox.us-east-1.amazonaws.com"
+BALANCE_CACHE_TTL_SECONDS = 30
 
 MTurkClient = Any
 
 MTURK_LOCALE_REQUIREMENT = "00000000000000000071"
 
-botoconfig = Config(retries=dict(max_attempts=10))
+botoconfig = Config(
+    retries=dict(max_attempts=10),
+    # Keep a bounded pool of persistent connections so sequential calls
+    # against the same client can reuse TCP+TLS sessions
+    max_pool_connections=20,
+)
 
 QUALIFICATION_TYPE_EXISTS_MESSAGE = (
     "You have already created a QualificationType with this name."
 )
 
+# Static question payloads, precomputed once rather than rebuilt on the
+# latency-critical HIT creation path
+EXTERNAL_QUESTION_SCHEMA_URL = (
+    "http://mechanicalturk.amazonaws.com/"
+    "AWSMechanicalTurkDataSchemas/2006-07-14/ExternalQuestion.xsd"
+)
+EXTERNAL_QUESTION_TEMPLATE = (
+    f'<ExternalQuestion xmlns="{EXTERNAL_QUESTION_SCHEMA_URL}">'
+    "<ExternalURL>{page_url}</ExternalURL>"
+    "<FrameHeight>{frame_height}</FrameHeight>"
+    "</ExternalQuestion>"
+)
+QUESTION_FORM_SCHEMA_URL = (
+    "http://mechanicalturk.amazonaws.com/"
+    "AWSMechanicalTurkDataSchemas/2017-11-06/QuestionForm.xsd"
+)
+COMPENSATION_QUESTION_TEMPLATE = (
+    f'<QuestionForm xmlns="{QUESTION_FORM_SCHEMA_URL}">'
+    "<Question>"
+    "<QuestionIdentifier>workerid</QuestionIdentifier>"
+    "<DisplayName>Confirm Worker ID</DisplayName>"
+    "<IsRequired>true</IsRequired>"
+    "<QuestionContent>"
+    "<Text>This compensation task was launched for the following reason: "
+    "{reason}... Enter Worker ID to submit</Text>"
+    "</QuestionContent>"
+    "<AnswerSpecification>"
+    "<FreeTextAnswer>"
+    "<Constraints>"
+    '<Length minLength="2" />'
+    '<AnswerFormatRegex regex="\\S" errorText="The content cannot be blank."/>'
+    "</Constraints>"
+    "</FreeTextAnswer>"
+    "</AnswerSpecification>"
+    "</Question>"
+    "</QuestionForm>"
+)
+
+DEFAULT_ALLOWED_LOCALES = (
+    {"Country": "US"},
+    {"Country": "CA"},
+    {"Country": "GB"},
+    {"Country": "AU"},
+    {"Country": "NZ"},
+)
+
+# Keys that MTurk qualification requirements are built from
+MTURK_QUALIFICATION_KEYS = (
+    "QualificationTypeId",
+    "Comparator",
+    "IntegerValue",
+    "IntegerValues",
+    "LocaleValues",
+    "ActionsGuarded",
+)
+
 
 def client_is_sandbox(client: MTurkClient) -> bool:
     """
@@ -180,9 +245,34 @@ def get_bonuses_for_assignment(client: MTurkClient, assignment_id: str) -> float
     return sum(bonus_amounts)
 
 
+# Cache of id(client) -> (fetch time, balance), as credential and balance
+# checks tend to query the same account back-to-back during launch
+_account_balance_cache: Dict[int, Tuple[float, float]] = {}
+
+
+def _get_account_balance(client: MTurkClient) -> float:
+    """
+    Get the available balance for the requester associated with this client,
+    reusing a recently-fetched value to avoid paying a full API round-trip
+    when balance checks are made back-to-back
+    """
+    cache_key = id(client)
+    now = time.monotonic()
+    cached = _account_balance_cache.get(cache_key)
+    if cached is not None and now - cached[0] < BALANCE_CACHE_TTL_SECONDS:
+        return cached[1]
+    try:
+        balance = float(client.get_account_balance()["AvailableBalance"])
+    except ClientError:
+        _account_balance_cache.pop(cache_key, None)
+        raise
+    _account_balance_cache[cache_key] = (now, balance)
+    return balance
+
+
 def get_requester_balance(client: MTurkClient) -> float:
     """Get the balance for the requester associated with this client"""
-    return float(client.get_account_balance()["AvailableBalance"])
+    return _get_account_balance(client)
 
 
 def check_mturk_balance(client: MTurkClient, balance_needed: float):
@@ -193,7 +283,7 @@ def check_mturk_balance(client: MTurkClient, balance_needed: float):
     # Test that you can connect to the API by checking your account balance
     # In Sandbox this always returns $10,000
     try:
-        user_balance = float(client.get_account_balance()["AvailableBalance"])
+        user_balance = _get_account_balance(client)
     except ClientError as e:
         if e.response["Error"]["Code"] == "RequestError":
             print(
@@ -246,9 +336,17 @@ def create_hit_config(
         hit_config_file.write(json.dumps(hit_config))
 
 
+# Cache of (id(client), qualification_name, must_be_owned) -> qualification
+# id, so repeated find-or-create attempts skip the list calls and scans
+_qualification_id_cache: Dict[Tuple[int, str, bool], str] = {}
+
+
 def delete_qualification(client: MTurkClient, qualification_id: str) -> None:
     """Deletes a qualification by id"""
     client.delete_qualification_type(QualificationTypeId=qualification_id)
+    for key, qual_id in list(_qualification_id_cache.items()):
+        if qual_id == qualification_id:
+            del _qualification_id_cache[key]
 
 
 def find_qualification(
@@ -291,7 +389,14 @@ def find_or_create_qualification(
     """Query amazon to find the existing qualification name, return the Id. If
     it exists and must_be_owned is true but we don't own it, this returns none.
     If it doesn't exist, the qualification is created
+
+    Successful resolutions are cached per-client, as the same qualifications
+    tend to be requested repeatedly over the course of a run
     """
+    cache_key = (id(client), qualification_name, must_be_owned)
+    cached_qual_id = _qualification_id_cache.get(cache_key)
+    if cached_qual_id is not None:
+        return cached_qual_id
 
     def _try_finding_qual_id():
         qual_usable, qual_id = find_qualification(
@@ -306,6 +411,8 @@ def find_or_create_qualification(
 
     found_qual, qual_id = _try_finding_qual_id()
     if found_qual:
+        if qual_id is not None:
+            _qualification_id_cache[cache_key] = qual_id
         return qual_id
 
     # Create the qualification, as it doesn't exist yet
@@ -321,11 +428,15 @@ def find_or_create_qualification(
             # Created this qualification somewhere else - find instead
             found_qual, qual_id = _try_finding_qual_id()
             assert found_qual, "Qualification exists, but could not be found?"
+            if qual_id is not None:
+                _qualification_id_cache[cache_key] = qual_id
             return qual_id
         else:
             raise e
 
-    return response["QualificationType"]["QualificationTypeId"]
+    qual_id = response["QualificationType"]["QualificationTypeId"]
+    _qualification_id_cache[cache_key] = qual_id
+    return qual_id
 
 
 def give_worker_qualification(
@@ -351,6 +462,36 @@ def give_worker_qualification(
         )
 
 
+def give_workers_qualification(
+    client: MTurkClient,
+    worker_ids: List[str],
+    qualification_id: str,
+    value: Optional[int] = None,
+) -> List[str]:
+    """
+    Give a qualification to each of the given workers, fanning the
+    underlying calls out over a thread pool rather than paying one
+    serial round-trip per worker.
+
+    Failures are logged and skipped; the failing worker ids are returned
+    """
+
+    def _give_qualification(worker_id: str) -> Optional[str]:
+        try:
+            give_worker_qualification(client, worker_id, qualification_id, value)
+            return None
+        except Exception as e:
+            logger.exception(
+                f'Failed to give worker with ID: "{worker_id}" qualification '
+                f"with error: {e}. Skipping."
+            )
+            return worker_id
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = executor.map(_give_qualification, worker_ids)
+    return [worker_id for worker_id in results if worker_id is not None]
+
+
 def remove_worker_qualification(
     client: MTurkClient, worker_id: str, qualification_id: str, reason: str = ""
 ) -> None:
@@ -360,34 +501,103 @@ def remove_worker_qualification(
     )
 
 
+async def _run_in_executor(func, *args, **kwargs):
+    """Run a blocking mturk_utils call without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+
+async def a_check_mturk_balance(client: MTurkClient, balance_needed: float):
+    """Async wrapper around check_mturk_balance"""
+    return await _run_in_executor(check_mturk_balance, client, balance_needed)
+
+
+async def a_find_or_create_qualification(
+    client: MTurkClient,
+    qualification_name: str,
+    description: str,
+    must_be_owned: bool = True,
+) -> Optional[str]:
+    """Async wrapper around find_or_create_qualification"""
+    return await _run_in_executor(
+        find_or_create_qualification,
+        client,
+        qualification_name,
+        description,
+        must_be_owned=must_be_owned,
+    )
+
+
+async def a_give_worker_qualification(
+    client: MTurkClient,
+    worker_id: str,
+    qualification_id: str,
+    value: Optional[int] = None,
+) -> None:
+    """Async wrapper around give_worker_qualification"""
+    await _run_in_executor(
+        give_worker_qualification, client, worker_id, qualification_id, value
+    )
+
+
+async def a_remove_worker_qualification(
+    client: MTurkClient, worker_id: str, qualification_id: str, reason: str = ""
+) -> None:
+    """Async wrapper around remove_worker_qualification"""
+    await _run_in_executor(
+        remove_worker_qualification, client, worker_id, qualification_id, reason
+    )
+
+
+def _resolve_mturk_qualification_ids(
+    client: MTurkClient, qualification_names: List[str]
+) -> Dict[str, Optional[str]]:
+    """
+    Find or create the MTurk qualifications for the given names, issuing
+    the underlying API calls concurrently rather than one-at-a-time
+    """
+
+    def _resolve(qualification_name: str) -> Optional[str]:
+        return find_or_create_qualification(
+            client,
+            qualification_name,
+            "Qualification required for Mephisto-launched tasks",
+            False,
+        )
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        qual_ids = executor.map(_resolve, qualification_names)
+    return dict(zip(qualification_names, qual_ids))
+
+
 def convert_mephisto_qualifications(
     client: MTurkClient, qualifications: List[Dict[str, Any]]
 ):
     """Convert qualifications from mephisto's format to MTurk's"""
     converted_qualifications = []
+
+    # Resolve all of the missing MTurk qualification ids up-front, as each
+    # otherwise costs a serial round-trip inside the conversion loop
+    names_to_resolve = []
     for qualification in qualifications:
-        converted = {}
-        mturk_keys = [
-            "QualificationTypeId",
-            "Comparator",
-            "IntegerValue",
-            "IntegerValues",
-            "LocaleValues",
-            "ActionsGuarded",
-        ]
-        for key in mturk_keys:
-            converted[key] = qualification.get(key)
+        if qualification.get("QualificationTypeId") is None:
+            qualification_name = qualification["qualification_name"]
+            if client_is_sandbox(client):
+                qualification_name += "_sandbox"
+            if qualification_name not in names_to_resolve:
+                names_to_resolve.append(qualification_name)
+    resolved_qual_ids: Dict[str, Optional[str]] = {}
+    if len(names_to_resolve) > 0:
+        resolved_qual_ids = _resolve_mturk_qualification_ids(client, names_to_resolve)
+
+    for qualification in qualifications:
+        converted = {key: qualification.get(key) for key in MTURK_QUALIFICATION_KEYS}
 
         if converted["QualificationTypeId"] is None:
             qualification_name = qualification["qualification_name"]
             if client_is_sandbox(client):
                 qualification_name += "_sandbox"
-            qual_id = find_or_create_qualification(
-                client,
-                qualification_name,
-                "Qualification required for Mephisto-launched tasks",
-                False,
-            )
+            qual_id = resolved_qual_ids[qualification_name]
             if qual_id is None:
                 logger.warning(
                     f"Qualification name {qualification_name} can not be found or created on MTurk. "
@@ -460,13 +670,7 @@ def create_hit_type(
     if not has_locale_qual and not client_is_sandbox(client):
         allowed_locales = get_config_arg("mturk", "allowed_locales")
         if allowed_locales is None:
-            allowed_locales = [
-                {"Country": "US"},
-                {"Country": "CA"},
-                {"Country": "GB"},
-                {"Country": "AU"},
-                {"Country": "NZ"},
-            ]
+            allowed_locales = list(DEFAULT_ALLOWED_LOCALES)
         locale_requirements.append(
             {
                 "QualificationTypeId": MTURK_LOCALE_REQUIREMENT,
@@ -497,30 +701,7 @@ def create_compensation_hit_with_hit_type(
     num_assignments: int = 1,
 ) -> Tuple[str, str, Dict[str, Any]]:
     """Creates a simple compensation HIT to direct workers to submit"""
-    amazon_ext_url = (
-        "http://mechanicalturk.amazonaws.com/"
-        "AWSMechanicalTurkDataSchemas/2017-11-06/QuestionForm.xsd"
-    )
-    question_data_structure = (
-        f'<QuestionForm xmlns="{amazon_ext_url}">'
-        "<Question>"
-        "<QuestionIdentifier>workerid</QuestionIdentifier>"
-        "<DisplayName>Confirm Worker ID</DisplayName>"
-        "<IsRequired>true</IsRequired>"
-        "<QuestionContent>"
-        f"<Text>This compensation task was launched for the following reason: {reason}... Enter Worker ID to submit</Text>"
-        "</QuestionContent>"
-        "<AnswerSpecification>"
-        "<FreeTextAnswer>"
-        "<Constraints>"
-        '<Length minLength="2" />'
-        '<AnswerFormatRegex regex="\S" errorText="The content cannot be blank."/>'
-        "</Constraints>"
-        "</FreeTextAnswer>"
-        "</AnswerSpecification>"
-        "</Question>"
-        "</QuestionForm>"
-    )
+    question_data_structure = COMPENSATION_QUESTION_TEMPLATE.format(reason=reason)
 
     is_sandbox = client_is_sandbox(client)
 
@@ -556,16 +737,8 @@ def create_hit_with_hit_type(
 ) -> Tuple[str, str, Dict[str, Any]]:
     """Creates the actual HIT given the type and page to direct clients to"""
     page_url = page_url.replace("&", "&amp;")
-    amazon_ext_url = (
-        "http://mechanicalturk.amazonaws.com/"
-        "AWSMechanicalTurkDataSchemas/2006-07-14/ExternalQuestion.xsd"
-    )
-    question_data_structure = (
-        '<ExternalQuestion xmlns="{}">'
-        "<ExternalURL>{}</ExternalURL>"  # noqa: E131
-        "<FrameHeight>{}</FrameHeight>"
-        "</ExternalQuestion>"
-        "".format(amazon_ext_url, page_url, frame_height)
+    question_data_structure = EXTERNAL_QUESTION_TEMPLATE.format(
+        page_url=page_url, frame_height=frame_height
     )
 
     is_sandbox = client_is_sandbox(client)
@@ -675,9 +848,15 @@ def unblock_worker(client: MTurkClient, worker_id: str, reason: str) -> None:
 
 def is_worker_blocked(client: MTurkClient, worker_id: str) -> bool:
     """Determine if the given worker is blocked by this client"""
-    blocks = client.list_worker_blocks(MaxResults=100)["WorkerBlocks"]
-    blocked_ids = [x["WorkerId"] for x in blocks]
-    return worker_id in blocked_ids
+    response = client.list_worker_blocks(MaxResults=100)
+    while True:
+        for block in response["WorkerBlocks"]:
+            if block["WorkerId"] == worker_id:
+                return True
+        next_token = response.get("NextToken")
+        if next_token is None or len(response["WorkerBlocks"]) == 0:
+            return False
+        response = client.list_worker_blocks(MaxResults=100, NextToken=next_token)
 
 
 def pay_bonus(
@@ -703,34 +882,67 @@ def pay_bonus(
         Reason=reason,
         UniqueRequestToken=unique_request_token,
     )
+    # The balance has changed, so any cached value is now stale
+    _account_balance_cache.pop(id(client), None)
 
     return True
 
 
+# notify_workers accepts at most this many worker ids per call
+NOTIFY_WORKERS_BATCH_SIZE = 100
+
+
+def email_workers(
+    client: MTurkClient, worker_ids: List[str], subject: str, message_text: str
+) -> List[Tuple[str, str]]:
+    """Send an email to each of the given workers through the mturk
+    client, using the API's native batching rather than one request
+    per worker.
+
+    Returns a list of (worker_id, failure_message) for any failures
+    """
+    failures: List[Tuple[str, str]] = []
+    for batch_start in range(0, len(worker_ids), NOTIFY_WORKERS_BATCH_SIZE):
+        batch = worker_ids[batch_start : batch_start + NOTIFY_WORKERS_BATCH_SIZE]
+        response = client.notify_workers(
+            Subject=subject, MessageText=message_text, WorkerIds=batch
+        )
+        for failure in response["NotifyWorkersFailureStatuses"]:
+            failures.append(
+                (failure["WorkerId"], failure["NotifyWorkersFailureMessage"])
+            )
+    return failures
+
+
 def email_worker(
     client: MTurkClient, worker_id: str, subject: str, message_text: str
 ) -> Tuple[bool, str]:
     """Send an email to a worker through the mturk client"""
-    response = client.notify_workers(
-        Subject=subject, MessageText=message_text, WorkerIds=[worker_id]
-    )
-    if len(response["NotifyWorkersFailureStatuses"]) > 0:
-        failure_message = response["NotifyWorkersFailureStatuses"][0]
-        return (False, failure_message["NotifyWorkersFailureMessage"])
+    failures = email_workers(client, [worker_id], subject, message_text)
+    if len(failures) > 0:
+        return (False, failures[0][1])
     else:
         return (True, "")
 
 
+def iter_outstanding_hits(client: MTurkClient):
+    """Yield the HITs that are still on the MTurk Server, one page at a
+    time, so callers can stop consuming without fetching every page
+    """
+    response = client.list_hits(MaxResults=100)
+    while len(response["HITs"]) > 0:
+        for hit in response["HITs"]:
+            yield hit
+        next_token = response.get("NextToken")
+        if next_token is None:
+            return
+        response = client.list_hits(MaxResults=100, NextToken=next_token)
+
+
 def get_outstanding_hits(client: MTurkClient) -> Dict[str, List[Dict[str, Any]]]:
     """Return the HITs sorted by HITTypeId that are still on the MTurk Server"""
-    new_hits = client.list_hits(MaxResults=100)
-    all_hits = new_hits["HITs"]
-    while len(new_hits["HITs"]) > 0:
-        new_hits = client.list_hits(MaxResults=100, NextToken=new_hits["NextToken"])
-        all_hits += new_hits["HITs"]
-
     hit_by_type: Dict[str, List[Dict[str, Any]]] = {}
-    for h in all_hits:
+    for h in iter_outstanding_hits(client):
         hit_type = h["HITTypeId"]
         if hit_type not in hit_by_type:
             hit_by_type[hit_type] = []
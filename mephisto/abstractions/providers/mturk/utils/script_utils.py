@@ -6,11 +6,12 @@
 
 from typing import List, Optional, TYPE_CHECKING, Dict
 
-from mephisto.abstractions.providers.mturk.mturk_utils import give_worker_qualification
+from mephisto.abstractions.providers.mturk.mturk_utils import (
+    give_workers_qualification,
+)
 from mephisto.abstractions.providers.mturk.mturk_requester import MTurkRequester
 from mephisto.data_model.requester import Requester
 from mephisto.data_model.unit import Unit
-from tqdm import tqdm  # type: ignore
 from mephisto.utils.logger_core import get_logger
 
 logging = get_logger(name=__name__)
@@ -49,15 +50,13 @@ def direct_assign_qual_mturk_workers(
         requester, MTurkRequester
     ), "Can only direct assign qualification (soft block) mturk workers from mturk requester"
     mturk_client = requester._get_client(requester._requester_name)
-    for worker_id in tqdm(worker_list):
-        try:
-            give_worker_qualification(
-                mturk_client, worker_id, qualification_id, value=1
-            )
-        except Exception as e:
-            logging.exception(
-                f'Failed to give worker with ID: "{worker_id}" qualification with error: {e}. Skipping.'
-            )
+    failed_worker_ids = give_workers_qualification(
+        mturk_client, worker_list, qualification_id, value=1
+    )
+    if len(failed_worker_ids) > 0:
+        logging.warning(
+            f"Could not give the qualification to workers: {failed_worker_ids}"
+        )
 
 
 def direct_soft_block_mturk_workers(
@@ -13,7 +13,7 @@ from mephisto.utils.logger_core import get_logger, warn_once
 from mephisto.utils.dirs import get_run_file_dir
 from dataclasses import dataclass, field, fields, Field
 from omegaconf import OmegaConf, MISSING, DictConfig
-from typing import List, Type, Dict, Any, TYPE_CHECKING
+from typing import List, Set, Type, Dict, Any, TYPE_CHECKING
 
 
 if TYPE_CHECKING:
@@ -92,6 +92,11 @@ def register_script_config(name: str, module: Any):
     config.store(name=name, node=module)
 
 
+# Directories already checked for hydra compatibility, so scripts that
+# register many configs only pay for (and see) the check once
+_compat_checked_dirs: Set[str] = set()
+
+
 def check_for_hydra_compat():
     # Required for determining 0.3.x to 0.4.0 conversion
     # of scripts
@@ -100,6 +105,9 @@ def check_for_hydra_compat():
 
     callsite = inspect.stack(0)[-1].filename
     call_dir = os.path.dirname(os.path.join(".", callsite))
+    if call_dir in _compat_checked_dirs:
+        return
+    _compat_checked_dirs.add(call_dir)
     if "hydra_configs" not in os.listdir(call_dir):
         logger.warning(
             "\u001b[31;1m"
@@ -24,7 +24,9 @@ def warn_once(msg: str) -> None:
     global _seen_logs
     if msg not in _seen_logs:
         _seen_logs.add(msg)
-        logging.warn(msg)
+        # stacklevel=2 attributes the warning to our caller, rather
+        # than to this wrapper
+        get_logger(name=__name__).warning(msg, stacklevel=2)
 
 
 def set_mephisto_log_level(verbose: Optional[bool] = None, level: Optional[str] = None):